@@ -0,0 +1,26 @@
+# gunicorn.conf.py — servidor.py (Anti-DDoS) sob gunicorn em vez do servidor de dev do Werkzeug
+# Rodar de dentro desta pasta, como root:
+#   sudo gunicorn -c gunicorn.conf.py servidor:app
+
+import servidor  # configura o server_core para este site
+import server_core
+
+# o app é carregado no master (root) antes do fork
+preload_app = True
+
+bind = f"{server_core.bind_host()}:{server_core.PORT}"
+
+# bans, janelas por IP e métricas vivem na memória do processo: um único
+# worker (fixo, sem WEB_CONCURRENCY), com várias threads atendendo requisições
+workers = 1
+worker_class = "gthread"
+threads = 16
+
+def on_starting(server):
+    # regras nft uma vez, no master
+    if not server_core.setup_firewall():
+        raise SystemExit(1)
+
+def post_fork(server, worker):
+    # threads não atravessam o fork: sobem dentro do worker
+    server_core.start_background()
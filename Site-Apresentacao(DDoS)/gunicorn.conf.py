@@ -0,0 +1,25 @@
+# gunicorn.conf.py — servidor.py (DDoS) sob gunicorn em vez do servidor de dev do Werkzeug
+# Rodar de dentro desta pasta:
+#   gunicorn -c gunicorn.conf.py servidor:app
+
+import servidor  # configura o server_core para este site
+import server_core
+
+preload_app = True
+
+bind = f"{server_core.bind_host()}:{server_core.PORT}"
+
+# métricas vivem na memória do processo e o /status publica o snapshot do
+# coletor: um único worker (um coletor por master, um só ETag por tick e uma
+# linha de CSV por coleta), com várias threads atendendo requisições
+workers = 1
+worker_class = "gthread"
+threads = 16
+
+# SO_REUSEPORT: permite subir uma instância nova na mesma porta antes de
+# derrubar a antiga (aqui não há bans em memória para ficarem divididos)
+reuse_port = True
+
+def post_fork(server, worker):
+    # threads não atravessam o fork: sobem dentro do worker
+    server_core.start_background()
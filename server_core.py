@@ -0,0 +1,1063 @@
+# server_core.py — código comum aos dois sites de apresentação: coletor de
+# métricas, /status, estáticos e, com mitigation=True, a mitigação L3/L4 via
+# nftables (rate-limit + blacklist). Cada site só chama create_app() no seu
+# servidor.py com a própria configuração.
+
+import os
+import sys
+import time
+import atexit
+import gzip
+import heapq
+import json
+import logging
+import mimetypes
+import queue
+import socket
+import struct
+import subprocess
+from threading import Condition, Event, Lock, Thread
+from array import array
+from collections import defaultdict, deque
+from functools import wraps
+
+from flask import Flask, Response, jsonify, send_file, send_from_directory, request, abort
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import psutil
+
+# binding oficial da libnftables (pacote python3-nftables); opcional — sem ele
+# as operações caem no binário `nft` via subprocess
+try:
+    import nftables
+except ImportError:
+    nftables = None
+
+# serializador JSON em C/Rust; opcional — sem ele o jsonify usa o json da stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ---------------- CONFIG ----------------
+STATIC_DIR = "site"       # relativo à pasta do site (create_app o torna absoluto)
+INDEX_PAGE = "monitoramento.html"  # página servida em "/" e para caminhos desconhecidos
+PORT = 8080
+CSV_FILE = "metrics.csv"   # None = não grava CSV
+MITIGATION_ENABLED = True  # detecção/ban (Python + nft); False = servidor sem defesa
+STATIC_RESCAN_INTERVAL = 5.0   # segundos entre varreduras de STATIC_DIR (arquivos novos/alterados)
+STATIC_CACHE_MAX = 256 * 1024  # arquivos até este tamanho ficam em memória; maiores vão por send_file
+
+# nginx na frente (ver nginx.conf): ele aplica o limit_req em C e o Flask escuta
+# só em 127.0.0.1, confiando no X-Forwarded-For que o nginx sobrescreve
+BEHIND_PROXY = False
+PROXY_PORT = 80            # porta pública do nginx (alvo das regras nft nesse modo)
+
+# Detecção de ataque (sliding window)
+WINDOW_SECONDS = 5         # janela para contar requisições
+THRESHOLD = 20             # requisições na janela => ban
+REQ_SHARDS = 16            # partições (lock + dict) do estado por IP; potência de 2
+REAPER_INTERVAL = 30       # segundos entre varreduras de IPs ociosos
+BAN_SECONDS = 0            # duração do ban; 0 = permanente (o kernel expira o elemento do set)
+BAN_BATCH_MAX = 256        # máximo de IPs por transação nft
+BAN_BATCH_WAIT = 0.1       # segundos esperando mais IPs antes de aplicar o lote
+
+# nftables rate limits (ajuste conforme necessário)
+TCP_HTTP_RATE = "50/second"    # novas conexões TCP HTTP (SYN/novas conexões)
+TCP_HTTP_BURST = 100
+UDP_RATE = "20/second"         # UDP flood na porta
+GENERIC_RATE = "1000/second"   # fallback: limite extremo por IP geral
+# detecção no kernel: novas conexões por IP de origem (meter); ~20 em 5s com o burst
+FLOOD_RATE = "4/second"
+FLOOD_BURST = 20
+FLOOD_BAN = "1h"               # tempo que o IP fica no set flood_src
+APP_RATE_LIMIT = True          # contagem por requisição em Python (pega keep-alive, que o meter não vê)
+
+COLLECT_INTERVAL = 1.0     # segundos entre coletas do collector
+TCP_SAMPLE_EVERY = 5       # conta conexões TCP a cada N coletas (muda devagar); entre elas repete a última
+
+# CSV: linhas acumuladas em memória e gravadas em lote por uma thread própria
+CSV_FLUSH_INTERVAL = 5.0   # segundos entre descargas do buffer para o disco
+CSV_FLUSH_ROWS = 10        # ou antes, assim que o buffer juntar esta quantidade de linhas
+
+# /status/stream (Server-Sent Events): cada stream aberto ocupa uma thread do
+# servidor, então há teto de clientes e de duração (o EventSource reconecta sozinho).
+# O teto global fica bem abaixo das 16 threads do gunicorn, e o por IP impede
+# que um único cliente ocupe todas as vagas
+STREAM_MAX_CLIENTS = 4
+STREAM_MAX_PER_IP = 1
+STREAM_MAX_SECONDS = 300
+STREAM_KEEPALIVE = 15.0    # segundos sem dado novo até mandar um comentário (mantém proxies abertos)
+
+# logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# sem a rota estática embutida do Flask (ela sombreava o proxy): os assets
+# saem pelo proxy, que consulta o manifesto em vez de fazer stat a cada hit
+app = Flask(__name__, static_folder=None)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify via orjson, com chaves ordenadas como no provider padrão."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS).decode()
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# ----------------- estado e locks -----------------
+banned_lock = Lock()
+
+# janelas por IP particionadas por hash: IPs diferentes não disputam o mesmo lock.
+# cada IP guarda [último segundo visto, contadores por segundo (anel de WINDOW_SECONDS)]
+req_shards = [(Lock(), defaultdict(lambda: [0, array("I", bytes(4 * WINDOW_SECONDS))]))
+              for _ in range(REQ_SHARDS)]
+banned_ips = {}            # ip -> instante de expiração (inf = permanente)
+_ban_heap = []             # (expiração, ip) dos bans temporários, menor primeiro
+_next_ban_expiry = float("inf")  # topo do heap publicado para leitura sem lock
+_ban_queue = queue.Queue() # IPs já banidos em memória, esperando o ban_writer_loop aplicar no nft
+
+# linhas do CSV já formatadas, esperando o flush. Um produtor (coletor) e um
+# consumidor (flusher): append/popleft do deque são atômicos, sem lock
+_csv_buffer = deque()
+_csv_flush_now = Event()
+
+_latest_metrics = {
+    "timestamp": int(time.time()),
+    "cpu_percent": 0.0,
+    "memory_percent": 0.0,
+    "memory_used_mb": 0.0,
+    "memory_total_mb": 0.0,
+    "tcp_established": -1,
+    "bytes_sent_per_s": 0.0,
+    "bytes_recv_per_s": 0.0,
+    "network_usage_percent": 0.0
+}
+# (corpo do /status já serializado, ETag): o coletor refaz 1x por tick, as
+# requisições só devolvem. Tupla publicada numa única atribuição: corpo e ETag
+# nunca aparecem desencontrados
+_latest_status = (app.json.dumps(_latest_metrics).encode(), '"0-0"')
+# acorda os streams SSE a cada publicação
+_status_cond = Condition()
+_stream_lock = Lock()
+_stream_clients = 0
+_stream_per_ip = defaultdict(int)   # streams abertos por IP (só IPs com stream ativo)
+
+# aberto uma única vez por init_csv(); o flusher escreve aqui sem reabrir o arquivo
+_csv_fd = None
+
+CSV_HEADER = (b"ts,cpu_percent,memory_percent,memory_used_mb,memory_total_mb,"
+              b"tcp_established,bytes_sent,bytes_recv,network_usage_percent\n")
+
+def init_csv():
+    """Abre o CSV (fd cru, O_APPEND) para o flusher; escreve o cabeçalho se estiver vazio."""
+    global _csv_fd
+    # sem camada de texto nem buffer do Python: o _csv_buffer já junta as linhas
+    _csv_fd = os.open(CSV_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    if os.fstat(_csv_fd).st_size == 0:
+        write_all(_csv_fd, CSV_HEADER)
+    atexit.register(close_csv)
+
+_prev_net = (0, 0)         # (bytes_sent, bytes_recv) da coleta anterior; ver read_system()
+_prev_ts = time.monotonic()   # base do delta das taxas (monotônico: imune a ajustes de NTP)
+_tcp_tick = 0              # coletas desde o início, para o TCP_SAMPLE_EVERY
+_last_tcp = -1             # última contagem de TCP ESTABLISHED
+
+# detectar NIC capacity (Mbps -> bytes/s)
+def detectar_capacidade_nic():
+    try:
+        stats = psutil.net_if_stats()
+        for name, st in stats.items():
+            if st.isup and getattr(st, "speed", None) and st.speed > 0:
+                return int(st.speed * 125_000)  # Mbps -> bytes/s
+    except Exception:
+        pass
+    return 125_000_000  # fallback 1Gbps
+
+NIC_CAPACITY = detectar_capacidade_nic()
+
+# constantes da coleta pré-calculadas: multiplicação no lugar de divisões por tick
+_INV_MB = 1.0 / (1024 * 1024)
+_NIC_PCT = 100.0 / NIC_CAPACITY
+
+# ---------------- nft helpers ----------------
+# contexto libnftables único para o processo (netlink direto, sem fork/exec).
+# o contexto não é thread-safe, daí o nft_lock
+_nft = None
+nft_lock = Lock()
+if nftables is not None:
+    _nft = nftables.Nftables()
+    _nft.set_json_output(True)
+
+def nft_json_cmd(cmds):
+    """Executa uma lista de comandos JSON na libnftables. Retorna (ok, saida_ou_erro)."""
+    try:
+        with nft_lock:
+            rc, out, err = _nft.json_cmd({"nftables": cmds})
+        if rc != 0:
+            return False, str(err).strip()
+        return True, out
+    except Exception as e:
+        logging.exception("falha na libnftables: %s", e)
+        return False, str(e)
+
+def nft_available():
+    if _nft is not None:
+        return True
+    try:
+        subprocess.run(["nft", "--version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return True
+    except Exception:
+        return False
+
+def run_nft_script(script_text):
+    """Aplica um script nft (libnftables se houver, senão nft -f -)"""
+    if _nft is not None:
+        try:
+            with nft_lock:
+                rc, out, err = _nft.cmd(script_text)
+        except Exception as e:
+            logging.exception("falha na libnftables: %s", e)
+            return False, str(e)
+        if rc != 0:
+            logging.error("nft deu erro: %s", err.strip())
+            return False, err.strip()
+        return True, out.strip()
+    try:
+        p = subprocess.run(["nft", "-f", "-"], input=script_text, text=True, capture_output=True)
+        if p.returncode != 0:
+            logging.error("nft deu erro: %s", p.stderr.strip())
+            return False, p.stderr.strip()
+        return True, p.stdout.strip()
+    except Exception as e:
+        logging.exception("falha ao rodar nft: %s", e)
+        return False, str(e)
+
+def ensure_nft_table_chain():
+    """
+    Cria tabela inet filter, set blacklist, e chain input com regras de rate-limit.
+    Se já existir, tenta não sobrescrever (mas garante que exista a set e as regras base).
+    """
+    if not nft_available():
+        logging.error("nft não encontrado no sistema. Instale nftables.")
+        return False
+
+    # atrás do nginx o tráfego externo chega na porta dele, não na do Flask
+    port = PROXY_PORT if BEHIND_PROXY else PORT
+
+    # timeout por elemento (BAN_SECONDS) só quando usado: o kernel não aceita
+    # redeclarar um set existente com flags diferentes
+    blacklist_flags = "flags timeout;" if BAN_SECONDS > 0 else ""
+
+    # script idempotente: cria tabela se não existe; cria set se não existe; adiciona chain se não existe
+    script = f"""
+table inet filter {{
+    # set de blacklist para bloqueios por IP (usado por Python também)
+    set blacklist {{
+        type ipv4_addr;
+        # com BAN_SECONDS > 0 o próprio kernel remove bans vencidos
+        {blacklist_flags}
+    }}
+
+    # estado do meter por IP (taxa de novas conexões), mantido pelo kernel
+    set flood_meter {{
+        type ipv4_addr;
+        flags dynamic,timeout;
+        timeout 1m;
+    }}
+
+    # IPs que estouraram o meter: banidos no kernel, sem passar pelo Python
+    set flood_src {{
+        type ipv4_addr;
+        flags dynamic,timeout;
+        timeout {FLOOD_BAN};
+    }}
+
+    chain input {{
+        type filter hook input priority 0; policy accept;
+
+        # drop blacklisted IPs
+        ip saddr @blacklist drop;
+        ip saddr @flood_src drop;
+
+        # descartar pacotes inválidos
+        ct state invalid drop;
+
+        # fast path: conexões já aceitas não passam pelas regras de limite abaixo
+        # (flowtable só vale para tráfego encaminhado; aqui o servidor é o destino)
+        ct state established,related accept
+
+        # Proteções específicas para porta pública do servidor (HTTP)
+        tcp dport {port} ct state new add @flood_meter {{ ip saddr limit rate over {FLOOD_RATE} burst {FLOOD_BURST} packets }} add @flood_src {{ ip saddr }} drop
+        tcp dport {port} ct state new limit rate over {TCP_HTTP_RATE} drop
+        # burst opcional pode ser adicionado via "limit rate over X/second burst Y" em versões
+        udp dport {port} limit rate over {UDP_RATE} drop
+
+        # limitação de novas conexões em geral (evita SYN flood)
+        ct state new limit rate over {GENERIC_RATE} drop
+    }}
+}}
+"""
+    ok, out = run_nft_script(script)
+    if not ok:
+        logging.error("Falha ao aplicar regras nft base: %s", out)
+        if "exists" in out.lower():
+            # tabela criada antes com outra definição (ex.: set sem/com flags timeout)
+            logging.error("A tabela inet filter já existe com definição incompatível. "
+                          "Recrie-a com: sudo nft delete table inet filter")
+        return False
+    logging.info("Tabela/chain/set nft garantidos.")
+    return True
+
+def nft_block_ip(ip):
+    """Adiciona IP ao set blacklist (com timeout de BAN_SECONDS, ou permanente se 0)."""
+    if _nft is not None:
+        elem = {"elem": {"val": ip, "timeout": BAN_SECONDS}} if BAN_SECONDS > 0 else ip
+        ok, out = nft_json_cmd([{"add": {"element": {
+            "family": "inet", "table": "filter", "name": "blacklist", "elem": [elem]}}}])
+        if not ok:
+            logging.error("Erro adicionando IP ao set: %s", out)
+            return False
+        logging.info("IP %s adicionado ao set blacklist (libnftables).", ip)
+        return True
+    try:
+        cmd = ["nft", "add", "element", "inet", "filter", "blacklist", "{", ip, "}"]
+        if BAN_SECONDS > 0:
+            cmd[-1:-1] = ["timeout", f"{BAN_SECONDS}s"]
+        p = subprocess.run(cmd, capture_output=True, text=True)
+        if p.returncode != 0:
+            # pode já existir; tentar verificar/ignorar
+            if "already exists" in p.stderr.lower() or "exists" in p.stderr.lower():
+                logging.info("IP %s já presente no set blacklist.", ip)
+                return True
+            logging.error("Erro adicionando IP ao set: %s", p.stderr.strip())
+            return False
+        logging.info("IP %s adicionado ao set blacklist (nft).", ip)
+        return True
+    except Exception as e:
+        logging.exception("falha em nft_block_ip: %s", e)
+        return False
+
+def nft_block_ips(ips):
+    """Adiciona vários IPs ao set blacklist numa única transação nft."""
+    if BAN_SECONDS > 0:
+        elems = [{"elem": {"val": ip, "timeout": BAN_SECONDS}} for ip in ips]
+        text = ", ".join(f"{ip} timeout {BAN_SECONDS}s" for ip in ips)
+    else:
+        elems = list(ips)
+        text = ", ".join(ips)
+    if _nft is not None:
+        ok, out = nft_json_cmd([{"add": {"element": {
+            "family": "inet", "table": "filter", "name": "blacklist", "elem": elems}}}])
+    else:
+        ok, out = run_nft_script(f"add element inet filter blacklist {{ {text} }}\n")
+    if not ok:
+        logging.error("Erro adicionando %d IP(s) ao set: %s", len(ips), out)
+    return ok
+
+def nft_unblock_ip(ip, name="blacklist"):
+    """Remove IP do set `name`. Retorna False também se o IP não estava no set."""
+    if _nft is not None:
+        ok, out = nft_json_cmd([{"delete": {"element": {
+            "family": "inet", "table": "filter", "name": name, "elem": [ip]}}}])
+    else:
+        try:
+            cmd = ["nft", "delete", "element", "inet", "filter", name, "{", ip, "}"]
+            p = subprocess.run(cmd, capture_output=True, text=True)
+            ok, out = p.returncode == 0, p.stderr.strip()
+        except Exception as e:
+            logging.exception("falha em nft_unblock_ip: %s", e)
+            return False
+    if not ok:
+        if "no such file" in str(out).lower():
+            # o IP não estava neste set (ex.: banido só pelo meter, não pela aplicação)
+            logging.info("IP %s não está no set %s.", ip, name)
+        else:
+            logging.error("Erro removendo IP do set %s: %s", name, out)
+        return False
+    logging.info("IP %s removido do set %s.", ip, name)
+    return True
+
+def nft_list_blacklist(name="blacklist"):
+    """IPs do set `name`, lidos da saída JSON do nft (libnftables ou `nft -j`)."""
+    if _nft is not None:
+        ok, out = nft_json_cmd([{"list": {"set": {
+            "family": "inet", "table": "filter", "name": name}}}])
+        if not ok or not out:
+            return []
+    else:
+        try:
+            p = subprocess.run(["nft", "-j", "list", "set", "inet", "filter", name],
+                               capture_output=True, text=True)
+            if p.returncode != 0:
+                return []
+            out = json.loads(p.stdout)
+        except Exception:
+            return []
+    ips = []
+    for obj in out.get("nftables", []):
+        # elementos vêm como "1.2.3.4" ou {"elem": {"val": "1.2.3.4", "timeout": ..., "expires": ...}}
+        for e in obj.get("set", {}).get("elem", []):
+            ips.append(e["elem"]["val"] if isinstance(e, dict) else e)
+    return ips
+
+# ---------------- DETECÇÃO / BAN (em memória + nft) ----------------
+# banned_lock só serializa quem ALTERA os bans. A leitura `ip in banned_ips` é
+# uma operação atômica de dict no CPython e dispensa o lock.
+def mark_banned(ip, now):
+    """Registra o ban em memória (chamar com banned_lock)."""
+    global _next_ban_expiry
+    if BAN_SECONDS > 0:
+        expires = now + BAN_SECONDS
+        heapq.heappush(_ban_heap, (expires, ip))
+        _next_ban_expiry = _ban_heap[0][0]
+    else:
+        expires = float("inf")
+    banned_ips[ip] = expires
+
+def expire_bans(now):
+    """Remove os bans vencidos pelo topo do heap."""
+    global _next_ban_expiry
+    with banned_lock:
+        while _ban_heap and _ban_heap[0][0] <= now:
+            expires, old = heapq.heappop(_ban_heap)
+            # entrada de um ban já removido ou renovado: ignora
+            if banned_ips.get(old) == expires:
+                del banned_ips[old]
+        _next_ban_expiry = _ban_heap[0][0] if _ban_heap else float("inf")
+
+def is_banned(ip, now):
+    """Checagem O(1) sem lock; só passa pelo banned_lock quando algum ban temporário venceu."""
+    if now >= _next_ban_expiry:
+        expire_bans(now)
+    return ip in banned_ips
+
+def req_shard(ip):
+    return req_shards[hash(ip) & (REQ_SHARDS - 1)]
+
+def register_request(ip, now):
+    sec = int(now)
+    lock, req_windows = req_shard(ip)
+    # seção crítica mínima: só a janela do IP no seu shard; o caminho comum
+    # (abaixo do limite) nunca toca banned_lock nem o nft
+    with lock:
+        win = req_windows[ip]
+        last, buckets = win
+        if sec > last:
+            # zera os segundos que passaram sem requisição desde a última
+            if sec - last >= WINDOW_SECONDS:
+                win[1] = buckets = array("I", bytes(4 * WINDOW_SECONDS))
+            else:
+                for t in range(last + 1, sec + 1):
+                    buckets[t % WINDOW_SECONDS] = 0
+            win[0] = sec
+        elif sec < last:
+            # `now` é lido antes do lock: uma thread atrasada pode chegar depois de
+            # outra com relógio maior. A janela nunca anda para trás; a requisição
+            # conta no segundo mais recente já aberto
+            sec = last
+        buckets[sec % WINDOW_SECONDS] += 1
+
+        # soma fixa de WINDOW_SECONDS contadores, independente do volume
+        if sum(buckets) < THRESHOLD:
+            return
+        req_windows.pop(ip, None)
+
+    # o ban vale na hora em memória (Flask já devolve 404); o kernel é
+    # atualizado em lote pelo ban_writer_loop, fora do caminho da requisição
+    with banned_lock:
+        if ip in banned_ips:
+            return
+        mark_banned(ip, now)
+    _ban_queue.put(ip)
+    logging.warning("IP %s banido por %s (trigger %d reqs in %ds).", ip,
+                    f"{BAN_SECONDS}s" if BAN_SECONDS > 0 else "tempo indeterminado", THRESHOLD, WINDOW_SECONDS)
+
+def ban_writer_loop():
+    """Drena a fila de bans e aplica no nft em lotes: um fork/transação por lote, não por IP."""
+    while True:
+        batch = [_ban_queue.get()]
+        deadline = time.monotonic() + BAN_BATCH_WAIT
+        while len(batch) < BAN_BATCH_MAX:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_ban_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        if nft_block_ips(batch):
+            logging.info("%d IP(s) adicionados ao set blacklist.", len(batch))
+            continue
+        # um IP inválido (ex.: IPv6 no set ipv4_addr) derruba a transação inteira:
+        # refaz um a um e desfaz em memória só os que falharem
+        failed = batch if len(batch) == 1 else [ip for ip in batch if not nft_block_ip(ip)]
+        with banned_lock:
+            for ip in failed:
+                banned_ips.pop(ip, None)
+
+def reaper_loop(interval=REAPER_INTERVAL):
+    """Descarta janelas de IPs sem requisição dentro de WINDOW_SECONDS (não podem mais gerar ban)."""
+    while True:
+        time.sleep(interval)
+        cutoff = int(time.monotonic()) - WINDOW_SECONDS
+        removed = 0
+        for lock, req_windows in req_shards:
+            with lock:
+                stale = [ip for ip, (last, _) in req_windows.items() if last <= cutoff]
+                for ip in stale:
+                    del req_windows[ip]
+            removed += len(stale)
+        if removed:
+            logging.info("reaper: %d IPs ociosos removidos.", removed)
+
+# ---------------- COLETOR EM BACKGROUND ----------------
+# sock_diag (linux/sock_diag.h, linux/inet_diag.h): o kernel devolve só os
+# sockets no estado pedido, em binário, numa conversa netlink — como o `ss`
+_NETLINK_SOCK_DIAG = 4
+_SOCK_DIAG_BY_FAMILY = 20
+_NLM_F_DUMP_REQUEST = 0x1 | 0x300   # NLM_F_REQUEST | NLM_F_DUMP
+_NLMSG_ERROR = 2
+_NLMSG_DONE = 3
+_TCPF_ESTABLISHED = 1 << 1
+_netlink_ok = hasattr(socket, "AF_NETLINK")  # desligado na primeira falha
+
+def count_established_netlink():
+    """Conta TCP ESTABLISHED (IPv4 + IPv6) via NETLINK_SOCK_DIAG, sem texto do /proc."""
+    n = 0
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, _NETLINK_SOCK_DIAG) as sk:
+        for seq, family in enumerate((socket.AF_INET, socket.AF_INET6), 1):
+            # nlmsghdr + inet_diag_req_v2 (family, protocol, ext, pad, states, sockid zerado)
+            req = struct.pack("=BBBBI48x", family, socket.IPPROTO_TCP, 0, 0, _TCPF_ESTABLISHED)
+            sk.send(struct.pack("=IHHII", 16 + len(req), _SOCK_DIAG_BY_FAMILY,
+                                _NLM_F_DUMP_REQUEST, seq, 0) + req)
+            done = False
+            while not done:
+                data = sk.recv(65536)
+                off = 0
+                while off + 16 <= len(data):
+                    length, kind = struct.unpack_from("=IH", data, off)
+                    if kind == _NLMSG_DONE:
+                        done = True
+                        break
+                    if kind == _NLMSG_ERROR:
+                        errno = -struct.unpack_from("=i", data, off + 16)[0]
+                        if family == socket.AF_INET6 and errno:
+                            done = True  # kernel sem IPv6
+                            break
+                        raise OSError(errno, "sock_diag")
+                    n += 1  # um inet_diag_msg por socket
+                    off += (length + 3) & ~3
+    return n
+
+def count_established():
+    """Conta TCP ESTABLISHED: netlink sock_diag; senão /proc/net/tcp{,6}; fallback psutil."""
+    global _netlink_ok
+    if _netlink_ok:
+        try:
+            return count_established_netlink()
+        except OSError as e:
+            _netlink_ok = False
+            logging.info("sock_diag indisponível (%s); usando /proc/net/tcp.", e)
+    if not os.path.exists("/proc/net/tcp"):
+        conns = psutil.net_connections(kind='inet')
+        return sum(1 for c in conns if c.status == 'ESTABLISHED')
+    n = 0
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            # leitura única em bytes: sem decodificar texto nem iterar o arquivo linha a linha
+            with open(path, "rb") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            continue  # kernel sem IPv6
+        # pula o cabeçalho; 4ª coluna (st): 01 == TCP_ESTABLISHED
+        n += sum(1 for line in lines[1:] if line.split(None, 4)[3] == b"01")
+    return n
+
+# ---- leitura direta do /proc (Linux) ----
+# só quatro números interessam: jiffies da linha "cpu", MemTotal/MemAvailable e
+# os bytes de rede. Os arquivos ficam abertos e são relidos com pread (sem
+# open/close nem as camadas do psutil); mesmas fórmulas do psutil
+def _open_proc(path):
+    try:
+        return os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+
+_fd_stat = _open_proc("/proc/stat")
+_fd_mem = _open_proc("/proc/meminfo")
+_fd_net = _open_proc("/proc/net/dev")
+_prev_cpu = (0, 0)         # (jiffies ocupados, jiffies totais) da leitura anterior
+
+def _pread_all(fd):
+    chunks = []
+    off = 0
+    while True:
+        b = os.pread(fd, 65536, off)
+        if not b:
+            return b"".join(chunks)
+        chunks.append(b)
+        off += len(b)
+
+def cpu_delta_percent(busy, total):
+    """% de CPU ocupada desde a leitura anterior, a partir dos tempos acumulados."""
+    global _prev_cpu
+    prev_busy, prev_total = _prev_cpu
+    _prev_cpu = (busy, total)
+    dt = total - prev_total
+    return round(min(100.0, max(0.0, (busy - prev_busy) / dt * 100.0)), 1) if dt > 0 else 0.0
+
+def read_system_proc():
+    """(cpu %, mem %, mem usada, mem total, bytes enviados, bytes recebidos) direto do /proc."""
+    # cpu  user nice system idle iowait irq softirq steal guest guest_nice
+    line = os.pread(_fd_stat, 1024, 0).split(b"\n", 1)[0]
+    v = [int(x) for x in line.split()[1:]]
+    total = sum(v) - sum(v[8:10])      # guest já está contado em user/nice
+    cpu = cpu_delta_percent(total - v[3] - v[4], total)  # ocupado: menos idle e iowait
+
+    mem_total = mem_avail = 0
+    for line in os.pread(_fd_mem, 4096, 0).split(b"\n"):
+        if line.startswith(b"MemTotal:"):
+            mem_total = int(line.split()[1]) * 1024
+        elif line.startswith(b"MemAvailable:"):
+            mem_avail = int(line.split()[1]) * 1024
+            break
+    mem_used = mem_total - mem_avail
+
+    # soma de todas as interfaces (inclusive lo), como o psutil.net_io_counters()
+    sent = recv = 0
+    for line in _pread_all(_fd_net).split(b"\n")[2:]:
+        if line:
+            f = line.split(b":", 1)[1].split()
+            recv += int(f[0])
+            sent += int(f[8])
+    return cpu, round(mem_used / mem_total * 100.0, 1), mem_used, mem_total, sent, recv
+
+def read_system_psutil():
+    """Mesma tupla de read_system_proc(), via psutil (fora do Linux)."""
+    # um cpu_times() e o delta feito aqui, com as fórmulas do psutil.cpu_percent
+    # (que guarda a leitura anterior por thread); os campos variam por SO
+    t = psutil.cpu_times()
+    total = sum(t) - getattr(t, "guest", 0) - getattr(t, "guest_nice", 0)
+    cpu = cpu_delta_percent(total - t.idle - getattr(t, "iowait", 0), total)
+    mem = psutil.virtual_memory()
+    net = psutil.net_io_counters()
+    return cpu, mem.percent, mem.used, mem.total, net.bytes_sent, net.bytes_recv
+
+read_system = read_system_psutil
+if None not in (_fd_stat, _fd_mem, _fd_net):
+    try:
+        read_system_proc()     # também inicializa _prev_cpu
+        read_system = read_system_proc
+    except Exception as e:
+        logging.info("leitura direta do /proc indisponível (%s); usando psutil.", e)
+_prev_net = read_system()[4:]
+
+def collect_once():
+    """Uma amostra: uma leitura de CPU/memória/rede (read_system) e, às vezes, do TCP."""
+    global _prev_net, _prev_ts, _latest_metrics, _latest_status, _tcp_tick, _last_tcp
+    ts = int(time.time())  # relógio de parede só para o campo timestamp; deltas usam monotonic
+    cpu, mem_percent, mem_used, mem_total, sent, recv = read_system()
+
+    # a leitura das tabelas TCP é a parte cara da coleta: só a cada TCP_SAMPLE_EVERY ticks
+    if _tcp_tick % TCP_SAMPLE_EVERY == 0:
+        try:
+            _last_tcp = count_established()
+        except Exception:
+            _last_tcp = -1
+    _tcp_tick += 1
+    tcp_est = _last_tcp
+
+    now = time.monotonic()
+    delta = max(1e-6, now - _prev_ts)
+
+    bytes_sent_per_s = (sent - _prev_net[0]) / delta
+    bytes_recv_per_s = (recv - _prev_net[1]) / delta
+    total_bps = bytes_sent_per_s + bytes_recv_per_s
+    usage_percent = min(100.0, total_bps * _NIC_PCT)
+
+    _prev_net = (sent, recv)
+    _prev_ts = now
+
+    metrics = {
+        "timestamp": ts,
+        "cpu_percent": round(cpu, 2),
+        "memory_percent": round(mem_percent, 2),
+        "memory_used_mb": round(mem_used * _INV_MB, 2),
+        "memory_total_mb": round(mem_total * _INV_MB, 2),
+        "tcp_established": tcp_est,
+        "bytes_sent_per_s": round(bytes_sent_per_s, 1),
+        "bytes_recv_per_s": round(bytes_recv_per_s, 1),
+        "network_usage_percent": round(usage_percent, 1)
+    }
+
+    # só enfileira a linha; o disco fica por conta do csv_flush_loop
+    if _csv_fd is not None:
+        # linha já em bytes: o flusher só concatena e entrega ao os.write
+        row = (f"{ts},{metrics['cpu_percent']},{metrics['memory_percent']},{metrics['memory_used_mb']},"
+               f"{metrics['memory_total_mb']},{tcp_est},{sent},{recv},"
+               f"{metrics['network_usage_percent']}\n").encode()
+        _csv_buffer.append(row)
+        if len(_csv_buffer) >= CSV_FLUSH_ROWS:
+            _csv_flush_now.set()
+
+    body = app.json.dumps(metrics).encode()
+    # timestamp + nº da coleta: muda a cada tick e não se repete após reiniciar
+    etag = f'"{ts}-{_tcp_tick}"'
+    # publicação por troca de referência (atômica sob o GIL), sem lock: o dict
+    # e a tupla são novos a cada tick e nunca mais alterados, então quem leu
+    # a referência antiga continua vendo um snapshot inteiro
+    _latest_metrics = metrics
+    _latest_status = (body, etag)
+    with _status_cond:
+        _status_cond.notify_all()
+
+def collector_loop(interval=COLLECT_INTERVAL):
+    # primeira leitura só para ter a base dos deltas de CPU e rede
+    global _prev_net, _prev_ts
+    _prev_net = read_system()[4:]
+    _prev_ts = time.monotonic()
+    while True:
+        try:
+            collect_once()
+        except Exception as e:
+            logging.warning("Collector warning: %s", e)
+        time.sleep(interval)
+
+def csv_flush_loop(interval=CSV_FLUSH_INTERVAL):
+    """Descarrega o buffer do CSV em uma única escrita a cada `interval` s ou CSV_FLUSH_ROWS linhas."""
+    while True:
+        _csv_flush_now.wait(interval)
+        _csv_flush_now.clear()
+        flush_csv()
+
+def flush_csv():
+    """Grava numa única escrita as linhas que já estavam no buffer."""
+    # retira só o que já estava lá; linhas novas ficam para a próxima rodada
+    buf = []
+    try:
+        for _ in range(len(_csv_buffer)):
+            buf.append(_csv_buffer.popleft())
+    except IndexError:
+        pass  # o close_csv() drenou ao mesmo tempo
+    if not buf:
+        return
+    try:
+        write_all(_csv_fd, b"".join(buf))
+    except Exception as e:
+        logging.warning("falha ao escrever CSV: %s", e)
+
+def write_all(fd, data):
+    """os.write até o fim (uma chamada no caso comum; repete se a escrita vier parcial)."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def close_csv():
+    """No encerramento (atexit): grava o que sobrou no buffer e fecha o arquivo."""
+    global _csv_fd
+    if _csv_fd is None:
+        return
+    flush_csv()
+    os.close(_csv_fd)
+    _csv_fd = None
+
+# ---------------- MANIFESTO DE ESTÁTICOS ----------------
+def load_static(full, old=None):
+    """(caminho, mtime_ns, mimetype, bytes ou None, etag) de um asset; reaproveita `old` se não mudou."""
+    st = os.stat(full)
+    if old is not None and old[1] == st.st_mtime_ns:
+        return old
+    data = None
+    if st.st_size <= STATIC_CACHE_MAX:
+        with open(full, "rb") as f:
+            data = f.read()
+    mimetype = mimetypes.guess_type(full)[0] or "application/octet-stream"
+    return full, st.st_mtime_ns, mimetype, data, f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def scan_static(root=None, old=None):
+    """Mapeia os arquivos de `root`: caminho relativo com '/' -> entrada de load_static().
+
+    Com `old` (manifesto anterior), só relê do disco os arquivos cujo mtime mudou.
+    """
+    root = root or STATIC_DIR
+    old = old or {}
+    files = {}
+    for r, _, names in os.walk(root):
+        for fn in names:
+            full = os.path.abspath(os.path.join(r, fn))
+            rel = os.path.relpath(full, os.path.abspath(root)).replace(os.sep, "/")
+            try:
+                files[rel] = load_static(full, old.get(rel))
+            except OSError:
+                continue  # removido durante a varredura
+    return files
+
+STATIC_FILES = {}          # preenchido por create_app(); trocado inteiro pelo static_watch_loop
+
+def static_watch_loop(interval=STATIC_RESCAN_INTERVAL):
+    """Reescaneia STATIC_DIR periodicamente: arquivos novos, alterados e removidos sem reiniciar."""
+    global STATIC_FILES
+    while True:
+        time.sleep(interval)
+        try:
+            STATIC_FILES = scan_static(old=STATIC_FILES)
+        except Exception as e:
+            logging.warning("falha ao reescanear %s: %s", STATIC_DIR, e)
+
+def send_static(entry):
+    """Responde com um asset do manifesto: bytes da memória (com ETag/304) ou send_file se grande."""
+    full, _, mimetype, data, etag = entry
+    if data is None:
+        return send_file(full, mimetype=mimetype)
+    if request.if_none_match.contains_raw(etag):
+        return Response(status=304, headers={"ETag": etag})
+    return Response(data, mimetype=mimetype, headers={"ETag": etag})
+
+# ---------------- CACHE SIMPLES INDEX ----------------
+# a página original já está em memória no manifesto (STATIC_FILES); aqui fica só
+# a versão gzip, refeita quando o static_watch_loop troca a entrada do índice
+_cached_index = (None, None)   # (entrada do manifesto, html_gzip)
+def cached_index():
+    """Devolve (entrada do manifesto, html_gzip); sem stat por requisição."""
+    global _cached_index
+    entry = STATIC_FILES.get(INDEX_PAGE)
+    if entry is None or entry[3] is None:
+        return entry, None
+    # load_static devolve a mesma tupla enquanto o arquivo não muda
+    if _cached_index[0] is not entry:
+        _cached_index = (entry, gzip.compress(entry[3], compresslevel=6))
+    return entry, _cached_index[1]
+
+# ---------------- FLASK HOOKS / ROTAS ----------------
+def guard_request(count=True):
+    """Barra IP banido (404) e, com `count`, conta a requisição na janela do IP."""
+    if not MITIGATION_ENABLED:
+        return
+    ip = request.remote_addr or "unknown"
+    now = time.monotonic()  # um único relógio por requisição; monotônico (imune a ajustes de NTP)
+
+    # se já banido em memória, devolver 404 rápido
+    if is_banned(ip, now):
+        abort(404)
+
+    if count and APP_RATE_LIMIT:
+        register_request(ip, now)
+
+def rate_limited(f):
+    """Checa ban e conta a requisição nas rotas decoradas."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        guard_request()
+        return f(*args, **kwargs)
+    return wrapper
+
+@app.route("/status")
+@rate_limited
+def status():
+    # sem lock: o coletor só troca a referência para uma tupla nova (atribuição atômica)
+    body, etag = _latest_status
+    # os dados mudam 1x por COLLECT_INTERVAL: clientes/proxies podem reaproveitar por 1 s
+    headers = {"ETag": etag, "Cache-Control": "max-age=1"}
+    if request.if_none_match.contains_raw(etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype="application/json", headers=headers)
+
+@app.route("/status/stream")
+@rate_limited
+def status_stream():
+    """Empurra cada snapshot novo aos clientes (SSE): uma escrita por tick, sem polling."""
+    global _stream_clients
+    ip = request.remote_addr or "unknown"
+    with _stream_lock:
+        if _stream_clients >= STREAM_MAX_CLIENTS or _stream_per_ip.get(ip, 0) >= STREAM_MAX_PER_IP:
+            # o monitoramento.html volta ao polling do /status
+            return Response(status=503, headers={"Retry-After": "5"})
+        _stream_clients += 1
+        _stream_per_ip[ip] += 1
+
+    def generate():
+        yield b"retry: 2000\n\n"
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        last = None
+        while time.monotonic() < deadline:
+            with _status_cond:
+                # checagem e espera sob o mesmo lock: uma publicação não se perde entre as duas
+                if _latest_status[1] == last:
+                    _status_cond.wait(STREAM_KEEPALIVE)
+            body, etag = _latest_status
+            if etag == last:
+                yield b": keepalive\n\n"
+                continue
+            last = etag
+            yield b"data: " + body + b"\n\n"
+
+    def release():
+        global _stream_clients
+        with _stream_lock:
+            _stream_clients -= 1
+            _stream_per_ip[ip] -= 1
+            if not _stream_per_ip[ip]:
+                del _stream_per_ip[ip]
+
+    resp = Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # chamado quando a resposta fecha, mesmo que o gerador nem tenha começado
+    resp.call_on_close(release)
+    return resp
+
+# rotas internas: registradas por create_app() só com a mitigação ligada
+def show_blacklist():
+    # junta lista em memória + sets nft para ver consistência; flood_src é
+    # preenchido pelo meter no kernel, sem passar pela aplicação
+    nftlist = nft_list_blacklist()
+    floodlist = nft_list_blacklist("flood_src")
+    with banned_lock:
+        mem = list(banned_ips)
+    return jsonify({"in_memory": mem, "nft_set": nftlist, "flood_src": floodlist})
+
+def unblock(ip):
+    # rota interna para remover dos bans (cuidado em prod): o IP pode estar na
+    # blacklist (aplicação), no flood_src (meter) ou nos dois
+    removed = [nft_unblock_ip(ip, name) for name in ("blacklist", "flood_src")]
+    if any(removed):
+        with banned_lock:
+            banned_ips.pop(ip, None)
+        return jsonify({"result": "unblocked", "ip": ip})
+    return jsonify({"result": "error", "msg": "failed to remove"}), 500
+
+def block(ip):
+    ok = nft_block_ip(ip)
+    if ok:
+        with banned_lock:
+            mark_banned(ip, time.monotonic())
+        return jsonify({"result": "blocked", "ip": ip})
+    return jsonify({"result": "error", "msg": "failed to add"}), 500
+
+@app.route("/")
+@rate_limited
+def index_route():
+    entry, data_gz = cached_index()
+    if data_gz is not None and "gzip" in request.headers.get("Accept-Encoding", ""):
+        # ETag próprio da representação gzip (a original usa o do manifesto)
+        etag = entry[4][:-1] + '-gz"'
+        headers = {'ETag': etag, 'Vary': 'Accept-Encoding'}
+        if request.if_none_match.contains_raw(etag):
+            return Response(status=304, headers=headers)
+        headers['Content-Encoding'] = 'gzip'
+        return Response(data_gz, mimetype="text/html", headers=headers)
+    if entry is not None:
+        resp = send_static(entry)
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
+    return send_from_directory(STATIC_DIR, INDEX_PAGE)
+
+@app.route("/<path:pth>")
+def proxy(pth):
+    # um lookup no manifesto; nenhum open/stat por requisição. Só caminhos vindos
+    # do os.walk casam (não há como sair da pasta)
+    entry = STATIC_FILES.get(pth)
+    # ban vale para tudo; assets (css/js/imagens) não contam na janela, mas
+    # páginas HTML e o fallback para INDEX_PAGE contam como a própria "/"
+    guard_request(count=entry is None or entry[2] == "text/html")
+    entry = entry or STATIC_FILES.get(INDEX_PAGE)
+    if entry is not None:
+        return send_static(entry)
+    return send_from_directory(STATIC_DIR, INDEX_PAGE)
+
+# ---------------- INICIALIZAÇÃO ----------------
+def env_int(name, default, lo, hi=None):
+    """Inteiro da variável de ambiente `name` (ou `default`); valor inválido encerra o servidor."""
+    raw = os.environ.get(name, default)
+    try:
+        value = int(raw)
+    except ValueError:
+        value = None
+    if value is None or value < lo or (hi is not None and value > hi):
+        faixa = f"{lo}-{hi}" if hi is not None else f">= {lo}"
+        print(f"Erro: {name} inválida: {raw!r} (esperado {faixa})")
+        sys.exit(1)
+    return value
+
+def create_app(root, mitigation=True, port=PORT, csv_file=CSV_FILE, index=INDEX_PAGE):
+    """Configura o núcleo para um site e devolve o app Flask.
+
+    `root` é a pasta do site (a que contém STATIC_DIR). Chamar uma vez, na
+    importação do servidor.py do site. As variáveis de ambiente PORT,
+    TCP_SAMPLE_EVERY e CSV_FILE (vazia = sem CSV) sobrepõem os valores do site.
+    """
+    global MITIGATION_ENABLED, PORT, TCP_SAMPLE_EVERY, CSV_FILE, INDEX_PAGE, STATIC_DIR, STATIC_FILES
+    MITIGATION_ENABLED = mitigation
+    PORT = env_int("PORT", port, 1, 65535)
+    TCP_SAMPLE_EVERY = env_int("TCP_SAMPLE_EVERY", TCP_SAMPLE_EVERY, 1)
+    CSV_FILE = os.environ.get("CSV_FILE", csv_file) or None
+    INDEX_PAGE = index
+    # send_from_directory resolve caminhos relativos a partir de app.root_path,
+    # que aqui seria a raiz do repositório: fixa o caminho absoluto do site
+    app.root_path = root
+    STATIC_DIR = os.path.join(root, STATIC_DIR)
+    STATIC_FILES = scan_static()
+
+    if mitigation:
+        # ---------------- safety: exigir root ----------------
+        if os.geteuid() != 0:
+            print("Erro: este servidor deve ser executado como root (sudo).")
+            print("Execute assim:\n   sudo python3 servidor.py\n")
+            sys.exit(1)
+
+        app.add_url_rule("/_internal/blacklist", view_func=show_blacklist)
+        app.add_url_rule("/_internal/unblock/<ip>", view_func=unblock)
+        app.add_url_rule("/_internal/block/<ip>", view_func=block)
+
+        if BEHIND_PROXY:
+            # remote_addr passa a ser o IP do cliente, não o do nginx
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+
+    if CSV_FILE:
+        init_csv()
+    return app
+
+# usadas pelo main() abaixo e pelos hooks do gunicorn.conf.py de cada site
+def setup_firewall():
+    """Garante as regras nft base e carrega a blacklist existente na memória."""
+    if not ensure_nft_table_chain():
+        logging.error("Falha ao garantir regras nft base.")
+        return False
+
+    # opcional: carregar blacklist existente do nft no memoria
+    existing = nft_list_blacklist()
+    now = time.monotonic()
+    with banned_lock:
+        for ip in existing:
+            mark_banned(ip, now)
+    return True
+
+def start_background():
+    """Sobe as threads de fundo. Threads não sobrevivem a fork: uma vez por processo servidor."""
+    Thread(target=collector_loop, args=(COLLECT_INTERVAL,), daemon=True).start()
+    Thread(target=static_watch_loop, args=(STATIC_RESCAN_INTERVAL,), daemon=True).start()
+    if _csv_fd is not None:
+        Thread(target=csv_flush_loop, args=(CSV_FLUSH_INTERVAL,), daemon=True).start()
+    if MITIGATION_ENABLED:
+        Thread(target=reaper_loop, args=(REAPER_INTERVAL,), daemon=True).start()
+        Thread(target=ban_writer_loop, daemon=True).start()
+
+def bind_host():
+    """Atrás do nginx o Flask só escuta no loopback."""
+    return "127.0.0.1" if MITIGATION_ENABLED and BEHIND_PROXY else "0.0.0.0"
+
+# ---------------- MAIN ----------------
+# servidor de desenvolvimento do Werkzeug; para carga use, na pasta do site:
+#   gunicorn -c gunicorn.conf.py servidor:app
+def main():
+    if MITIGATION_ENABLED:
+        logging.info("Iniciando servidor — garantindo nftables e inicializando collector.")
+        if not setup_firewall():
+            logging.error("Saindo.")
+            sys.exit(1)
+    start_background()
+
+    host = bind_host()
+    logging.info("Servidor rodando em http://%s:%d (NIC cap ~ %d bytes/s)", host, PORT, NIC_CAPACITY)
+    app.run(host=host, port=PORT, threaded=True)